@@ -4,12 +4,26 @@
 import os
 import re
 import time
+import socket
+import signal
+import asyncio
 import logging
 import inspect
+import functools
+from enum import IntEnum
+from collections import deque
 from dataclasses import dataclass
 from typing import Optional, Any, List, Dict
 
-from pymodbus.client import ModbusTcpClient
+from pymodbus.client import AsyncModbusTcpClient
+
+try:
+    from pymodbus.exceptions import ConnectionException, ModbusIOException
+except ImportError:  # ältere pymodbus-Varianten
+    ConnectionException = OSError  # type: ignore[assignment,misc]
+    ModbusIOException = OSError  # type: ignore[assignment,misc]
+
+log = logging.getLogger("ess_accu_off")
 
 
 # =========================
@@ -21,9 +35,18 @@ from pymodbus.client import ModbusTcpClient
 # Wichtig: systemd EnvironmentFile übernimmt sonst alles nach '=' als Wert.
 _INLINE_COMMENT_RE = re.compile(r"\s+[;#].*$")
 
+# CSV-Listen: ',' oder ';' als Trenner, Whitespace drumherum egal.
+# Achtung: ';' ist hier Trenner, kein Kommentarzeichen -> eigene Kommentar-Regel
+_CSV_SEP_RE = re.compile(r"[,;]")
+_CSV_COMMENT_RE = re.compile(r"\s+#.*$")
+
 
+@functools.lru_cache(maxsize=256)
 def _clean_env_value(v: str) -> str:
     v = v.strip()
+    # Fast path: kein Kommentar, keine Quotes -> fertig
+    if "#" not in v and ";" not in v and (not v or v[0] not in "\"'"):
+        return v
     # Optional quotes entfernen
     if len(v) >= 2 and v[0] == v[-1] and v[0] in ("'", '"'):
         v = v[1:-1]
@@ -98,11 +121,15 @@ def env_csv_ints(name: str, default: List[int]) -> List[int]:
     v = os.getenv(name)
     if v is None:
         return default
-    v = _clean_env_value(v)
-    parts = [p.strip() for p in v.split(",") if p.strip()]
-    if not parts:
-        return default
-    return [int(p, 10) for p in parts]
+    # NICHT _clean_env_value: dessen ';'-Kommentarregel würde ab dem ersten
+    # " ;" den Rest der Liste verschlucken (z.B. "811; 812 ;813" -> [811, 812]).
+    v = v.strip()
+    if len(v) >= 2 and v[0] == v[-1] and v[0] in ("'", '"'):
+        v = v[1:-1]
+    v = _CSV_COMMENT_RE.sub("", v)
+    # int() toleriert umgebenden Whitespace -> ein Durchlauf ohne strip-Zwischenliste
+    vals = [int(p, 10) for p in _CSV_SEP_RE.split(v) if p.strip()]
+    return vals or default
 
 
 def _bootstrap_env() -> None:
@@ -187,10 +214,73 @@ DRY_RUN = env_bool("DRY_RUN", False)
 
 LOG_LEVEL = env_str("LOG_LEVEL", "INFO").upper()
 
+# Vorberechnet: sind die PV-Register ein zusammenhängender Block?
+# Dann reicht ein einzelner read_block statt N einzelner Reads.
+_PV_CONTIG = all(PV_REGS[i + 1] - PV_REGS[i] == 1 for i in range(len(PV_REGS) - 1))
+
+# Vorberechnet: Gesamtspanne aller Messwert-Register (SOC, Load, PV).
+# Liegt alles dicht genug beisammen (Modbus FC03 erlaubt bis 125 Register),
+# holen wir alles in EINEM Request und schneiden per Offset heraus.
+_MEAS_REGS = [REG_SOC, REG_LOAD_BASE, REG_LOAD_BASE + 1, REG_LOAD_BASE + 2] + list(PV_REGS)
+_MEAS_BASE = min(_MEAS_REGS)
+_MEAS_COUNT = max(_MEAS_REGS) - _MEAS_BASE + 1
+_MEAS_ONE_BLOCK = _MEAS_COUNT <= 120
+
+# Poll-Plan: Enable liegt meist direkt neben den Messwerten (806 vs. 811..843).
+# Passt alles in einen FC03-Request, wird pro Poll nur EIN Read auf
+# READ_UNIT_ID ausgeführt (Enable + SOC + Load + PV zusammen).
+_POLL_REGS = [REG_ENABLE] + _MEAS_REGS
+_POLL_BASE = min(_POLL_REGS)
+_POLL_COUNT = max(_POLL_REGS) - _POLL_BASE + 1
+_POLL_ONE_BLOCK = _POLL_COUNT <= 120
+
+# SOC-Skalierung einmal vorberechnen (Multiplikation statt Division pro Poll)
+_SOC_SCALE = 1.0 / (SOC_DIVISOR if SOC_DIVISOR != 0 else 1.0)
+
+# Adaptives Poll-Intervall: während "warte auf Nacht" reicht grobe Auflösung,
+# Nachterkennung auf NIGHT_CONFIRM_S-Skala braucht keine 5s-Abtastung.
+_IDLE_POLL_S = max(float(POLL_INTERVAL_S), min(NIGHT_CONFIRM_S / 10.0, 60.0))
+
+# Nachterkennung als Ring: ein bool-Sample pro Poll-Periode. Nacht gilt als
+# erkannt, wenn fast das komplette NIGHT_CONFIRM_S-Fenster unter der
+# PV-Schwelle lag. Zählerbasiert statt Float-Integrator -> kein Rundungsdrift.
+_NIGHT_RING_LEN = max(1, round(NIGHT_CONFIRM_S / POLL_INTERVAL_S))
+
+# Toleranz gegen kurze PV-Blips über der Schwelle (Wechselrichter-Rauschen in
+# der Dämmerung). Der alte Integrator baute pro Sekunde "drüber" nur
+# NIGHT_DECAY_FACTOR Sekunden Fortschritt ab; Fortschritt war also möglich,
+# solange der Drüber-Anteil unter decay/(1+decay) lag. Gleicher Anteil hier
+# als Sample-Budget, damit NIGHT_DECAY_FACTOR weiter wirkt.
+_NIGHT_RING_TOL = min(
+    _NIGHT_RING_LEN - 1,
+    round(_NIGHT_RING_LEN * (NIGHT_DECAY_FACTOR / (1.0 + NIGHT_DECAY_FACTOR))),
+)
+_NIGHT_RING_THRESH = _NIGHT_RING_LEN - max(0, _NIGHT_RING_TOL)
+
+# Timer-Schwellen vorab in Integer-Nanosekunden (für time.monotonic_ns Gates)
+_MIN_WRITE_GAP_NS = int(MIN_WRITE_GAP_S * 1e9)
+_MIN_ESS_WRITE_GAP_NS = int(MIN_ESS_WRITE_GAP_S * 1e9)
+_PV_SURPLUS_CONFIRM_NS = int(PV_SURPLUS_CONFIRM_S * 1e9)
+_OFF_DELAY_NS = int(OFF_DELAY_SECONDS * 1e9)
+
+# Mode/ESS ändern sich nur durch eigene Writes; extern getriebene Änderungen
+# reichen wir mit ~6 Poll-Perioden Verzögerung nach statt jede Iteration zu lesen.
+_MODE_REFRESH_NS = int(POLL_INTERVAL_S * 6 * 1e9)
+
 
 # =========================
 # Logging
 # =========================
+
+# Für den Status-Log: Index mit bool(x) statt Ternary pro Feld
+_YN = ("no", "yes")
+
+_STATUS_FMT = (
+    "STATE=%s | SOC=%.1f%% | Load=%sW | PV=%sW | Surplus=%s (%s >=%ss) | "
+    "Night=%s (%.0f/%.0fs) | awaitNextDay=%s nightSeen=%s | ModeIst=%s | ESS=%s->%s"
+)
+
+
 def setup_logging() -> None:
     logger = logging.getLogger()
     logger.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
@@ -200,55 +290,126 @@ def setup_logging() -> None:
     logger.propagate = False
 
 
+# Einmal aufgebaut statt if-Kette pro Aufruf (wird pro Status-Log benutzt)
+_MODE_NAMES = {
+    MODE_CHARGER_ONLY: "ChargerOnly",
+    MODE_ON: "On",
+    MODE_OFF: "Off",
+}
+
+
 def mode_name(v: Optional[int]) -> str:
     if v is None:
         return "Unknown"
-    if v == MODE_OFF:
-        return "Off"
-    if v == MODE_CHARGER_ONLY:
-        return "ChargerOnly"
-    if v == MODE_ON:
-        return "On"
-    return str(v)
+    return _MODE_NAMES.get(v) or str(v)
 
 
 # =========================
 # Modbus-Kompatibilität
 # =========================
+@functools.lru_cache(maxsize=None)
+def _probe_kwarg_names(client_cls: type) -> tuple:
+    """Ermittelt einmal pro Client-Klasse die kwarg-Namen der pymodbus-Version.
+
+    inspect.signature ist teuer; das Ergebnis ist für eine pymodbus-Version
+    konstant, daher wird es hier gecacht statt pro Instanz neu ermittelt.
+    """
+    rh_params = inspect.signature(client_cls.read_holding_registers).parameters
+    wr_params = inspect.signature(client_cls.write_register).parameters
+
+    # Je nach pymodbus-Version heißen die args unterschiedlich
+    unit_kw_r = next(
+        (k for k in ("device_id", "slave", "unit", "unit_id", "dev_id") if k in rh_params),
+        None,
+    )
+    unit_kw_w = next(
+        (k for k in ("device_id", "slave", "unit", "unit_id", "dev_id") if k in wr_params),
+        None,
+    )
+    count_kw = next(
+        (k for k in ("count", "quantity", "qty", "length", "size") if k in rh_params),
+        None,
+    )
+    return unit_kw_r, unit_kw_w, count_kw
+
+
 class ModbusAdapter:
     """Wrapper, der mit verschiedenen pymodbus Signaturen klarkommt."""
 
     def __init__(self, host: str, port: int, timeout: int = 2):
-        self.client = ModbusTcpClient(host, port=port, timeout=timeout)
+        self.client = AsyncModbusTcpClient(host, port=port, timeout=timeout)
         self._rh = self.client.read_holding_registers
         self._wr = self.client.write_register
 
-        rh_params = inspect.signature(self._rh).parameters
-        wr_params = inspect.signature(self._wr).parameters
+        self.unit_kw_r, self.unit_kw_w, self.count_kw = _probe_kwarg_names(AsyncModbusTcpClient)
 
-        # Je nach pymodbus-Version heißen die args unterschiedlich
-        self.unit_kw_r = next(
-            (k for k in ("device_id", "slave", "unit", "unit_id", "dev_id") if k in rh_params),
-            None,
-        )
-        self.unit_kw_w = next(
-            (k for k in ("device_id", "slave", "unit", "unit_id", "dev_id") if k in wr_params),
-            None,
-        )
-        self.count_kw = next(
-            (k for k in ("count", "quantity", "qty", "length", "size") if k in rh_params),
-            None,
-        )
+        # Offset einmalig nach int wandeln statt pro Aufruf
+        self._ofs = int(ADDR_OFFSET)
 
-        logging.info(
+        # Kwarg-Dicts pro (unit_id, count) bzw. unit_id wiederverwenden,
+        # statt pro Modbus-Aufruf ein frisches Dict zu bauen
+        self._read_kw: Dict[Any, Dict[str, Any]] = {}
+        self._write_kw: Dict[int, Dict[str, Any]] = {}
+
+        log.info(
             "ModbusAdapter: read unit_kw=%s count_kw=%s | write unit_kw=%s",
             self.unit_kw_r,
             self.count_kw,
             self.unit_kw_w,
         )
 
-    def connect(self) -> bool:
-        return self.client.connect()
+    async def connect(self) -> bool:
+        ok = await self.client.connect()
+        if ok:
+            self._tune_socket()
+        return ok
+
+    def _tune_socket(self) -> None:
+        """TCP_NODELAY + Keepalive auf dem darunterliegenden Socket setzen.
+
+        pymodbus setzt kein TCP_NODELAY, d.h. kleine Requests können im
+        Kernel auf ACK-Coalescing (Nagle) warten. Keepalive hält die
+        Verbindung über lange Poll-Pausen am Leben.
+        """
+        try:
+            sock = getattr(self.client, "socket", None)
+            if sock is None:
+                # pymodbus 3.x: Transport hängt am TransactionManager (client.ctx)
+                transport = getattr(getattr(self.client, "ctx", None), "transport", None)
+                if transport is None:
+                    transport = getattr(self.client, "transport", None)
+                if transport is not None and hasattr(transport, "get_extra_info"):
+                    sock = transport.get_extra_info("socket")
+            if sock is None:
+                log.debug("Socket-Tuning übersprungen: kein Socket am Client gefunden")
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            if hasattr(socket, "TCP_KEEPIDLE"):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 30)
+            if hasattr(socket, "TCP_KEEPINTVL"):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 10)
+            if hasattr(socket, "TCP_KEEPCNT"):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+        except (AttributeError, OSError):
+            # Je nach pymodbus-Variante ist der Socket anders erreichbar
+            pass
+
+    def is_socket_open(self) -> bool:
+        try:
+            connected = getattr(self.client, "connected", None)
+            if connected is not None:
+                return bool(connected)
+            return bool(self.client.is_socket_open())
+        except Exception:
+            return False
+
+    async def ensure_connected(self) -> None:
+        """Lazy-Reconnect: verbindet nur, wenn der Socket nicht mehr offen ist."""
+        if self.is_socket_open():
+            return
+        if not await self.connect():
+            raise RuntimeError("Modbus connect() fehlgeschlagen")
 
     def close(self) -> None:
         try:
@@ -261,45 +422,64 @@ class ModbusAdapter:
         if hasattr(rr, "isError") and rr.isError():
             raise RuntimeError(f"{what}: {rr}")
 
-    def read_u16(self, unit_id: int, reg: int) -> int:
-        addr = int(reg) + int(ADDR_OFFSET)
-        kw: Dict[str, Any] = {}
-        if self.count_kw:
-            kw[self.count_kw] = 1
-        if self.unit_kw_r:
-            kw[self.unit_kw_r] = int(unit_id)
-        rr = self._rh(addr, **kw)
+    def _read_kwargs(self, unit_id: int, count: int) -> Dict[str, Any]:
+        kw = self._read_kw.get((unit_id, count))
+        if kw is None:
+            kw = {}
+            if self.count_kw:
+                kw[self.count_kw] = count
+            if self.unit_kw_r:
+                kw[self.unit_kw_r] = unit_id
+            self._read_kw[(unit_id, count)] = kw
+        return kw
+
+    async def read_u16(self, unit_id: int, reg: int) -> int:
+        addr = reg + self._ofs
+        rr = await self._rh(addr, **self._read_kwargs(unit_id, 1))
         self._check(rr, f"Read error unit={unit_id} reg={reg}")
-        return int(rr.registers[0])
+        # pymodbus liefert bereits int
+        return rr.registers[0]
+
+    async def try_read_u16(self, unit_id: int, reg: int) -> Optional[int]:
+        """Wie read_u16, aber Modbus-Fehlerantworten liefern None statt Exception.
+
+        Für optionale Reads (Mode/ESS): ein Branch auf isError() ist deutlich
+        billiger als raise + except pro Poll. Transportfehler (Socket weg)
+        propagieren weiterhin, damit der Reconnect-Pfad greift.
+        """
+        addr = reg + self._ofs
+        rr = await self._rh(addr, **self._read_kwargs(unit_id, 1))
+        if hasattr(rr, "isError") and rr.isError():
+            log.warning("Read fehlgeschlagen unit=%s reg=%s: %s", unit_id, reg, rr)
+            return None
+        return rr.registers[0]
 
-    def read_block(self, unit_id: int, base_reg: int, count: int) -> List[int]:
+    async def read_block(self, unit_id: int, base_reg: int, count: int) -> List[int]:
         # Fallback: wenn read_holding_registers keine count kw hat
         if not self.count_kw and count != 1:
-            return [self.read_u16(unit_id, base_reg + i) for i in range(count)]
-
-        addr = int(base_reg) + int(ADDR_OFFSET)
-        kw: Dict[str, Any] = {self.count_kw: int(count)} if self.count_kw else {}
-        if self.unit_kw_r:
-            kw[self.unit_kw_r] = int(unit_id)
+            return [await self.read_u16(unit_id, base_reg + i) for i in range(count)]
 
-        rr = self._rh(addr, **kw)
+        addr = base_reg + self._ofs
+        rr = await self._rh(addr, **self._read_kwargs(unit_id, count))
         self._check(rr, f"Read error unit={unit_id} reg={base_reg} count={count}")
 
-        regs = [int(x) for x in rr.registers[:count]]
+        # pymodbus liefert bereits list[int]; nicht erneut materialisieren
+        regs = rr.registers
         if len(regs) < count:
             # Safety fallback
-            return [self.read_u16(unit_id, base_reg + i) for i in range(count)]
-        return regs
+            return [await self.read_u16(unit_id, base_reg + i) for i in range(count)]
+        return regs[:count] if len(regs) > count else regs
 
-    def write_u16(self, unit_id: int, reg: int, value: int) -> None:
+    async def write_u16(self, unit_id: int, reg: int, value: int) -> None:
         if DRY_RUN:
-            logging.warning("DRY_RUN: würde schreiben unit=%s reg=%s value=%s", unit_id, reg, value)
+            log.warning("DRY_RUN: würde schreiben unit=%s reg=%s value=%s", unit_id, reg, value)
             return
-        addr = int(reg) + int(ADDR_OFFSET)
-        kw: Dict[str, Any] = {}
-        if self.unit_kw_w:
-            kw[self.unit_kw_w] = int(unit_id)
-        rr = self._wr(addr, int(value), **kw)
+        addr = reg + self._ofs
+        kw = self._write_kw.get(unit_id)
+        if kw is None:
+            kw = {self.unit_kw_w: unit_id} if self.unit_kw_w else {}
+            self._write_kw[unit_id] = kw
+        rr = await self._wr(addr, int(value), **kw)
         if hasattr(rr, "isError") and rr.isError():
             raise RuntimeError(f"Write error unit={unit_id} reg={reg} value={value}: {rr}")
 
@@ -307,68 +487,236 @@ class ModbusAdapter:
 # =========================
 # Messwerte / Reads
 # =========================
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Measurements:
     soc_percent: float
     load_w: int
     pv_w: int
 
 
-def get_measurements(mb: ModbusAdapter) -> Measurements:
-    soc_raw = mb.read_u16(READ_UNIT_ID, REG_SOC)
-    divisor = SOC_DIVISOR if SOC_DIVISOR != 0 else 1.0
-    soc = float(soc_raw) / float(divisor)
+def _measurements_from_block(block: List[int], base: int) -> Measurements:
+    soc_raw = block[REG_SOC - base]
+    lo = REG_LOAD_BASE - base
+    load_w = block[lo] + block[lo + 1] + block[lo + 2]
+    pv_w = sum(block[r - base] for r in PV_REGS)
+    return Measurements(soc_percent=soc_raw * _SOC_SCALE, load_w=load_w, pv_w=pv_w)
+
+
+async def get_measurements(mb: ModbusAdapter) -> Measurements:
+    if _MEAS_ONE_BLOCK:
+        # Ein einziger Modbus-Request für SOC + Load + PV
+        block = await mb.read_block(READ_UNIT_ID, _MEAS_BASE, _MEAS_COUNT)
+        return _measurements_from_block(block, _MEAS_BASE)
 
-    l = mb.read_block(READ_UNIT_ID, REG_LOAD_BASE, 3)
-    load_w = int(l[0]) + int(l[1]) + int(l[2])
+    if _PV_CONTIG and PV_REGS:
+        # Reads überlappen lassen; Modbus TCP multiplext per transaction_id
+        soc_raw, l, pv = await asyncio.gather(
+            mb.read_u16(READ_UNIT_ID, REG_SOC),
+            mb.read_block(READ_UNIT_ID, REG_LOAD_BASE, 3),
+            mb.read_block(READ_UNIT_ID, PV_REGS[0], len(PV_REGS)),
+        )
+        pv_w = sum(pv)
+    else:
+        soc_raw, l = await asyncio.gather(
+            mb.read_u16(READ_UNIT_ID, REG_SOC),
+            mb.read_block(READ_UNIT_ID, REG_LOAD_BASE, 3),
+        )
+        pv_w = 0
+        for r in PV_REGS:
+            pv_w += await mb.read_u16(READ_UNIT_ID, r)
 
-    pv_w = 0
-    for r in PV_REGS:
-        pv_w += int(mb.read_u16(READ_UNIT_ID, int(r)))
+    return Measurements(soc_percent=soc_raw * _SOC_SCALE, load_w=sum(l), pv_w=pv_w)
 
-    return Measurements(soc_percent=float(soc), load_w=int(load_w), pv_w=int(pv_w))
 
+async def read_enabled(mb: ModbusAdapter) -> int:
+    return await mb.read_u16(READ_UNIT_ID, REG_ENABLE)
 
-def read_enabled(mb: ModbusAdapter) -> int:
-    return int(mb.read_u16(READ_UNIT_ID, REG_ENABLE))
 
+async def poll_all(mb: ModbusAdapter) -> "tuple[int, Measurements]":
+    """Ein Poll = möglichst ein Modbus-Request: Enable + Messwerte zusammen."""
+    if not _POLL_ONE_BLOCK:
+        return await read_enabled(mb), await get_measurements(mb)
+    block = await mb.read_block(READ_UNIT_ID, _POLL_BASE, _POLL_COUNT)
+    enabled = block[REG_ENABLE - _POLL_BASE]
+    return enabled, _measurements_from_block(block, _POLL_BASE)
 
-def read_current_mode(mb: ModbusAdapter) -> Optional[int]:
-    try:
-        return int(mb.read_u16(MODE_UNIT_ID, REG_MODE))
-    except Exception as e:
-        logging.warning("Mode lesen fehlgeschlagen (unit=%s reg=%s): %s", MODE_UNIT_ID, REG_MODE, e)
-        return None
 
+async def read_current_mode(mb: ModbusAdapter) -> Optional[int]:
+    return await mb.try_read_u16(MODE_UNIT_ID, REG_MODE)
 
-def read_ess_mode(mb: ModbusAdapter) -> Optional[int]:
-    try:
-        return int(mb.read_u16(ESS_UNIT_ID, REG_ESS_MODE))
-    except Exception as e:
-        logging.warning("ESS Mode lesen fehlgeschlagen (unit=%s reg=%s): %s", ESS_UNIT_ID, REG_ESS_MODE, e)
-        return None
+
+async def read_ess_mode(mb: ModbusAdapter) -> Optional[int]:
+    return await mb.try_read_u16(ESS_UNIT_ID, REG_ESS_MODE)
 
 
-def set_mode(mb: ModbusAdapter, mode: int) -> None:
-    mb.write_u16(MODE_UNIT_ID, REG_MODE, int(mode))
+async def set_mode(mb: ModbusAdapter, mode: int) -> None:
+    await mb.write_u16(MODE_UNIT_ID, REG_MODE, mode)
 
 
-def set_ess_mode(mb: ModbusAdapter, value: int) -> None:
-    mb.write_u16(ESS_UNIT_ID, REG_ESS_MODE, int(value))
+async def set_ess_mode(mb: ModbusAdapter, value: int) -> None:
+    await mb.write_u16(ESS_UNIT_ID, REG_ESS_MODE, value)
 
 
 # =========================
 # State Machine
 # =========================
-STATE_OFF = "OFF"
-STATE_CHARGING = "CHARGING"      # ChargerOnly tagsüber, bis SOC_CHARGE_MIN
-STATE_ON = "ON"                  # ON latched bis SOC_MIN
-STATE_OFF_DELAY = "OFF_DELAY"    # ChargerOnly OFF_DELAY_SECONDS, dann Off
+class State(IntEnum):
+    OFF = 0
+    CHARGING = 1   # ChargerOnly tagsüber, bis SOC_CHARGE_MIN
+    ON = 2         # ON latched bis SOC_MIN
+    OFF_DELAY = 3  # ChargerOnly OFF_DELAY_SECONDS, dann Off
+
+# Von den Handlern benutzte Schwellen, einmal vorab koerziert
+_POLL_INTERVAL_S_F = float(POLL_INTERVAL_S)
+_SOC_MIN_F = float(SOC_MIN)
+_SOC_CHARGE_MIN_F = float(SOC_CHARGE_MIN)
+
+
+@dataclass(slots=True)
+class RunContext:
+    """Veränderlicher Loop-Zustand; wird von den State-Handlern gelesen/gesetzt."""
+
+    mb: ModbusAdapter
+    now_ns: int = 0
+    m: Optional[Measurements] = None
+    current_mode: Optional[int] = None
+    current_ess: Optional[int] = None
+    last_write_ns: int = 0
+    last_ess_write_ns: int = 0
+    mode_cache_until_ns: int = 0
+    ess_cache_until_ns: int = 0
+    pv_surplus_since_ns: Optional[int] = None
+    off_delay_start_ns: Optional[int] = None
+    await_next_day: bool = False
+    night_seen_since_shutdown: bool = False
+    night_detected: bool = False
+    pv_surplus_confirmed: bool = False
+    sleep_s: float = _POLL_INTERVAL_S_F
+
+
+def _can_write(ctx: RunContext) -> bool:
+    return (ctx.now_ns - ctx.last_write_ns) >= _MIN_WRITE_GAP_NS
+
+
+async def _write_mode(ctx: RunContext, target: int) -> None:
+    if ctx.current_mode == target:
+        return
+    if not _can_write(ctx):
+        return
+    log.warning("Setze Mode -> %s", mode_name(target))
+    await set_mode(ctx.mb, target)
+    ctx.last_write_ns = ctx.now_ns
+    ctx.current_mode = target  # optimistisch
+    ctx.mode_cache_until_ns = ctx.now_ns + _MIN_WRITE_GAP_NS
+
+
+async def _handle_off(ctx: RunContext) -> State:
+    # nach Abschaltung erst wieder starten, wenn Nacht einmal gesehen wurde
+    if ctx.await_next_day and not ctx.night_seen_since_shutdown:
+        # Hier kann sich stundenlang nichts tun -> seltener pollen
+        ctx.sleep_s = _IDLE_POLL_S
+        return State.OFF
+
+    ctx.sleep_s = _POLL_INTERVAL_S_F
+    if not ctx.pv_surplus_confirmed:
+        return State.OFF
+
+    # Sonne/Überschuss: wenn SOC < charge-min => ChargerOnly, sonst ON
+    if ctx.m.soc_percent < _SOC_CHARGE_MIN_F:
+        await _write_mode(ctx, MODE_CHARGER_ONLY)
+        next_state = State.CHARGING
+    else:
+        await _write_mode(ctx, MODE_ON)
+        next_state = State.ON
+
+    ctx.await_next_day = False
+    ctx.night_seen_since_shutdown = False
+    return next_state
+
+
+async def _handle_charging(ctx: RunContext) -> State:
+    ctx.sleep_s = _POLL_INTERVAL_S_F
+
+    # nachts und SOC < SOC_CHARGE_MIN => OFF bleiben (kein Laden nachts)
+    if (
+        TURN_OFF_AT_NIGHT_WHEN_BELOW_CHARGE_MIN
+        and ctx.night_detected
+        and (ctx.m.soc_percent < _SOC_CHARGE_MIN_F)
+        and (not ctx.pv_surplus_confirmed)
+    ):
+        await _write_mode(ctx, MODE_OFF)
+        ctx.await_next_day = True
+        ctx.night_seen_since_shutdown = True  # Nacht ist ja gerade erkannt
+        ctx.pv_surplus_since_ns = None
+        return State.OFF
+
+    # tagsüber normal: ChargerOnly halten bis SOC_CHARGE_MIN erreicht
+    # (nur schreiben, wenn der Ist-Mode tatsächlich abweicht)
+    if ctx.current_mode != MODE_CHARGER_ONLY:
+        await _write_mode(ctx, MODE_CHARGER_ONLY)
+
+    if ctx.m.soc_percent >= _SOC_CHARGE_MIN_F:
+        await _write_mode(ctx, MODE_ON)
+        return State.ON
+
+    return State.CHARGING
+
+
+async def _handle_on(ctx: RunContext) -> State:
+    ctx.sleep_s = _POLL_INTERVAL_S_F
+
+    if ctx.current_mode != MODE_ON:
+        await _write_mode(ctx, MODE_ON)
+
+    if ctx.m.soc_percent <= _SOC_MIN_F:
+        # Sequenz starten: ChargerOnly OFF_DELAY_SECONDS, dann Off
+        await _write_mode(ctx, MODE_CHARGER_ONLY)
+        ctx.off_delay_start_ns = ctx.now_ns
+        return State.OFF_DELAY
+
+    return State.ON
+
+
+async def _handle_off_delay(ctx: RunContext) -> State:
+    if ctx.current_mode != MODE_CHARGER_ONLY:
+        await _write_mode(ctx, MODE_CHARGER_ONLY)
+
+    if ctx.off_delay_start_ns is None:
+        ctx.off_delay_start_ns = ctx.now_ns
+
+    if (ctx.now_ns - ctx.off_delay_start_ns) >= _OFF_DELAY_NS:
+        await _write_mode(ctx, MODE_OFF)
+        ctx.off_delay_start_ns = None
+        ctx.await_next_day = True
+        ctx.night_seen_since_shutdown = False
+        ctx.pv_surplus_since_ns = None
+        ctx.sleep_s = _POLL_INTERVAL_S_F
+        return State.OFF
+
+    # Bis zum OFF-Deadline gibt es nichts zu tun: in einem Stück schlafen
+    # statt alle POLL_INTERVAL_S neu zu pollen. Dank _sleep_or_stop bleibt
+    # der Countdown trotzdem per Signal unterbrechbar.
+    remaining_s = (_OFF_DELAY_NS - (ctx.now_ns - ctx.off_delay_start_ns)) * 1e-9
+    ctx.sleep_s = max(0.0, remaining_s)
+    return State.OFF_DELAY
+
+
+# Dispatch per Tupel-Index (State ist 0..3) statt Dict-Hash
+_HANDLERS = (_handle_off, _handle_charging, _handle_on, _handle_off_delay)
+
 
+async def _sleep_or_stop(stop: "asyncio.Event", timeout: float) -> bool:
+    """Wartet timeout Sekunden, aber unterbrechbar; True = Stop signalisiert."""
+    try:
+        await asyncio.wait_for(stop.wait(), timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
 
-def main() -> None:
+
+async def main() -> None:
     setup_logging()
-    logging.info(
+    log.info(
         "Start. Enable: unit=%s reg=%s muss 1 | Mode: unit=%s reg=%s | ESS: unit=%s reg=%s | ESS night switch=%s",
         READ_UNIT_ID,
         REG_ENABLE,
@@ -380,227 +728,196 @@ def main() -> None:
     )
 
     mb = ModbusAdapter(VENUS_IP, VENUS_PORT, timeout=int(MODBUS_TIMEOUT_S))
+    ctx = RunContext(mb=mb)
 
-    last_write_ts = 0.0
-    last_ess_write_ts = 0.0
-
-    # PV surplus confirm timer
-    pv_surplus_since: Optional[float] = None
-
-    # Tolerante Night-Erkennung (Integrator)
-    last_loop_ts = time.monotonic()
-    night_accum_s = 0.0
+    # SIGTERM/SIGINT wecken die Schleife sofort statt bis zu sleep_s zu warten
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            # z.B. Plattform ohne Signal-Support
+            pass
 
-    # Nach Abschaltung: erst wieder starten, wenn "Nacht einmal gesehen" wurde
-    await_next_day = False
-    night_seen_since_shutdown = False
+    # Häufig gelesene Konfigwerte als Locals (LOAD_FAST statt LOAD_GLOBAL im Loop)
+    poll_interval_s = _POLL_INTERVAL_S_F
+    pv_night_w = PV_NIGHT_W
+    pv_surplus_w = PV_SURPLUS_W
+    night_confirm_s = NIGHT_CONFIRM_S
 
-    # OFF delay
-    off_delay_start: Optional[float] = None
+    # Tolerante Night-Erkennung (Ring aus bool-Samples + laufender Zähler)
+    last_loop_ns = time.monotonic_ns()
+    night_ring: "deque[bool]" = deque(maxlen=_NIGHT_RING_LEN)
+    night_below = 0
 
     # State
-    state = STATE_OFF
+    state = State.OFF
     initialized = False
 
-    while True:
-        try:
-            if not mb.connect():
-                raise RuntimeError("Modbus connect() fehlgeschlagen")
-
-            enabled = read_enabled(mb)
-            if enabled != 1:
-                logging.info("Deaktiviert (Enable=%s). Keine Aktionen.", enabled)
-
-                pv_surplus_since = None
-                await_next_day = False
-                night_seen_since_shutdown = False
-                off_delay_start = None
-                state = STATE_OFF
-                initialized = False
-
-                last_loop_ts = time.monotonic()
-                night_accum_s = 0.0
-
-                time.sleep(float(POLL_INTERVAL_S))
-                continue
-
-            # Messung
-            now = time.monotonic()
-            m = get_measurements(mb)
-            current_mode = read_current_mode(mb)
-            current_ess = read_ess_mode(mb)
-
-            # initial state once
-            if not initialized:
-                if current_mode == MODE_ON:
-                    state = STATE_ON
-                elif current_mode == MODE_CHARGER_ONLY:
-                    state = STATE_CHARGING
-                else:
-                    state = STATE_OFF
-                initialized = True
-                logging.info("Initial state=%s (ModeIst=%s)", state, mode_name(current_mode))
-
-            # dt für Integrator
-            dt = max(0.0, now - last_loop_ts)
-            last_loop_ts = now
-
-            # --- tolerante Nachterkennung ---
-            if m.pv_w < PV_NIGHT_W:
-                night_accum_s = min(float(NIGHT_CONFIRM_S), night_accum_s + dt)
-            else:
-                night_accum_s = max(0.0, night_accum_s - dt * float(NIGHT_DECAY_FACTOR))
-
-            night_detected = night_accum_s >= float(NIGHT_CONFIRM_S)
-
-            if await_next_day and night_detected:
-                night_seen_since_shutdown = True
-
-            # --- PV surplus detection (stabil) ---
-            pv_surplus = m.pv_w >= (m.load_w + int(PV_SURPLUS_W))
-            if pv_surplus:
-                pv_surplus_since = pv_surplus_since or now
-            else:
-                pv_surplus_since = None
-
-            pv_surplus_confirmed = (pv_surplus_since is not None) and (
-                (now - pv_surplus_since) >= int(PV_SURPLUS_CONFIRM_S)
-            )
-
-            # --- ESS Mode Sync ---
-            if ESS_ALLOW_NIGHT_SWITCH:
-                desired_ess = ESS_NIGHT_VALUE if night_detected else ESS_DAY_VALUE
-            else:
-                desired_ess = ESS_DAY_VALUE
-
-            if (now - last_ess_write_ts) >= float(MIN_ESS_WRITE_GAP_S):
-                if current_ess is not None and current_ess != desired_ess:
-                    logging.warning("Setze ESS Mode -> %s (war %s)", desired_ess, current_ess)
-                    set_ess_mode(mb, desired_ess)
-                    last_ess_write_ts = now
-                    current_ess = desired_ess  # optimistisch
-
-            # Status Log
-            logging.info(
-                "STATE=%s | SOC=%.1f%% | Load=%sW | PV=%sW | Surplus=%s (%s >=%ss) | Night=%s (%.0f/%.0fs) | awaitNextDay=%s nightSeen=%s | ModeIst=%s | ESS=%s->%s",
-                state,
-                m.soc_percent,
-                m.load_w,
-                m.pv_w,
-                "yes" if pv_surplus else "no",
-                "yes" if pv_surplus_confirmed else "no",
-                int(PV_SURPLUS_CONFIRM_S),
-                "yes" if night_detected else "no",
-                night_accum_s,
-                float(NIGHT_CONFIRM_S),
-                "yes" if await_next_day else "no",
-                "yes" if night_seen_since_shutdown else "no",
-                mode_name(current_mode),
-                current_ess,
-                desired_ess,
-            )
-
-            def can_write() -> bool:
-                return (now - last_write_ts) >= float(MIN_WRITE_GAP_S)
-
-            def write_mode(target: int) -> None:
-                nonlocal last_write_ts, current_mode
-                if current_mode == target:
-                    return
-                if not can_write():
-                    return
-                logging.warning("Setze Mode -> %s", mode_name(target))
-                set_mode(mb, target)
-                last_write_ts = now
-                current_mode = target  # optimistisch
-
-            # ------------- State Machine -------------
-
-            if state == STATE_OFF:
-                # nach Abschaltung erst wieder starten, wenn Nacht einmal gesehen wurde
-                if await_next_day and not night_seen_since_shutdown:
-                    time.sleep(float(POLL_INTERVAL_S))
-                    continue
+    # Deadline-basierter Takt: next_wake wandert um sleep_s weiter, die
+    # tatsächliche Wartezeit ist next_wake - monotonic(). So bleibt die
+    # Periode stabil, auch wenn die Modbus-Reads mal 300 ms brauchen
+    # (wichtig für die Nacht-Ring-Samples auf NIGHT_CONFIRM_S-Skala).
+    next_wake = time.monotonic()
 
-                if pv_surplus_confirmed:
-                    # Sonne/Überschuss: wenn SOC < charge-min => ChargerOnly, sonst ON
-                    if m.soc_percent < float(SOC_CHARGE_MIN):
-                        write_mode(MODE_CHARGER_ONLY)
-                        state = STATE_CHARGING
-                    else:
-                        write_mode(MODE_ON)
-                        state = STATE_ON
-
-                    await_next_day = False
-                    night_seen_since_shutdown = False
-
-                time.sleep(float(POLL_INTERVAL_S))
-                continue
-
-            if state == STATE_CHARGING:
-                # nachts und SOC < SOC_CHARGE_MIN => OFF bleiben (kein Laden nachts)
-                if (
-                    TURN_OFF_AT_NIGHT_WHEN_BELOW_CHARGE_MIN
-                    and night_detected
-                    and (m.soc_percent < float(SOC_CHARGE_MIN))
-                    and (not pv_surplus_confirmed)
-                ):
-                    write_mode(MODE_OFF)
-                    state = STATE_OFF
-                    await_next_day = True
-                    night_seen_since_shutdown = True  # Nacht ist ja gerade erkannt
-                    pv_surplus_since = None
-                    time.sleep(float(POLL_INTERVAL_S))
+    try:
+        while True:
+            try:
+                # Verbindung bleibt über Iterationen offen; nur bei Bedarf neu aufbauen
+                await mb.ensure_connected()
+
+                # Enable + Messwerte in einem Request (siehe _POLL_ONE_BLOCK)
+                enabled, m = await poll_all(mb)
+                if enabled != 1:
+                    log.info("Deaktiviert (Enable=%s). Keine Aktionen.", enabled)
+
+                    # Logik-Zustand verwerfen, aber die Write-Rate-Limits
+                    # überleben einen Disable/Enable-Toggle
+                    ctx = RunContext(
+                        mb=mb,
+                        last_write_ns=ctx.last_write_ns,
+                        last_ess_write_ns=ctx.last_ess_write_ns,
+                    )
+                    state = State.OFF
+                    initialized = False
+
+                    last_loop_ns = time.monotonic_ns()
+                    night_ring.clear()
+                    night_below = 0
+
+                    next_wake += poll_interval_s
+                    if await _sleep_or_stop(stop, max(0.0, next_wake - time.monotonic())):
+                        break
                     continue
 
-                # tagsüber normal: ChargerOnly halten bis SOC_CHARGE_MIN erreicht
-                write_mode(MODE_CHARGER_ONLY)
-
-                if m.soc_percent >= float(SOC_CHARGE_MIN):
-                    write_mode(MODE_ON)
-                    state = STATE_ON
-
-                time.sleep(float(POLL_INTERVAL_S))
-                continue
-
-            if state == STATE_ON:
-                write_mode(MODE_ON)
-
-                if m.soc_percent <= float(SOC_MIN):
-                    # Sequenz starten: ChargerOnly OFF_DELAY_SECONDS, dann Off
-                    write_mode(MODE_CHARGER_ONLY)
-                    state = STATE_OFF_DELAY
-                    off_delay_start = now
-
-                time.sleep(float(POLL_INTERVAL_S))
-                continue
-
-            if state == STATE_OFF_DELAY:
-                write_mode(MODE_CHARGER_ONLY)
-
-                if off_delay_start is None:
-                    off_delay_start = now
-
-                if (now - off_delay_start) >= int(OFF_DELAY_SECONDS):
-                    write_mode(MODE_OFF)
-                    state = STATE_OFF
-                    off_delay_start = None
-
-                    await_next_day = True
-                    night_seen_since_shutdown = False
-                    pv_surplus_since = None
+                now_ns = time.monotonic_ns()
+                ctx.now_ns = now_ns
+                ctx.m = m
+
+                # Mode/ESS nur lesen, wenn der Cache abgelaufen ist
+                if now_ns >= ctx.mode_cache_until_ns:
+                    ctx.current_mode = await read_current_mode(mb)
+                    ctx.mode_cache_until_ns = now_ns + _MODE_REFRESH_NS
+                if now_ns >= ctx.ess_cache_until_ns:
+                    ctx.current_ess = await read_ess_mode(mb)
+                    ctx.ess_cache_until_ns = now_ns + _MODE_REFRESH_NS
+
+                # initial state once
+                if not initialized:
+                    if ctx.current_mode == MODE_ON:
+                        state = State.ON
+                    elif ctx.current_mode == MODE_CHARGER_ONLY:
+                        state = State.CHARGING
+                    else:
+                        state = State.OFF
+                    initialized = True
+                    log.info(
+                        "Initial state=%s (ModeIst=%s)", state.name, mode_name(ctx.current_mode)
+                    )
+
+                # dt, um nach längeren Sleeps entsprechend viele Samples nachzuziehen
+                dt = max(0, now_ns - last_loop_ns) * 1e-9
+                last_loop_ns = now_ns
+
+                # --- tolerante Nachterkennung ---
+                sample = m.pv_w < pv_night_w
+                for _ in range(min(_NIGHT_RING_LEN, max(1, round(dt / poll_interval_s)))):
+                    if len(night_ring) == _NIGHT_RING_LEN:
+                        night_below -= night_ring[0]
+                    night_ring.append(sample)
+                    night_below += sample
+
+                ctx.night_detected = (
+                    len(night_ring) == _NIGHT_RING_LEN and night_below >= _NIGHT_RING_THRESH
+                )
+
+                if ctx.await_next_day and ctx.night_detected:
+                    ctx.night_seen_since_shutdown = True
+
+                # --- PV surplus detection (stabil) ---
+                pv_surplus = m.pv_w >= (m.load_w + pv_surplus_w)
+                if pv_surplus:
+                    ctx.pv_surplus_since_ns = ctx.pv_surplus_since_ns or now_ns
+                else:
+                    ctx.pv_surplus_since_ns = None
 
-                time.sleep(float(POLL_INTERVAL_S))
-                continue
+                ctx.pv_surplus_confirmed = (ctx.pv_surplus_since_ns is not None) and (
+                    (now_ns - ctx.pv_surplus_since_ns) >= _PV_SURPLUS_CONFIRM_NS
+                )
 
-        except KeyboardInterrupt:
-            logging.info("Beendet (Ctrl+C).")
-            break
-        except Exception as e:
-            logging.error("Fehler: %s", e, exc_info=True)
-            mb.close()
-            time.sleep(2.0)
+                # --- ESS Mode Sync ---
+                if ESS_ALLOW_NIGHT_SWITCH:
+                    desired_ess = ESS_NIGHT_VALUE if ctx.night_detected else ESS_DAY_VALUE
+                else:
+                    desired_ess = ESS_DAY_VALUE
+
+                if (now_ns - ctx.last_ess_write_ns) >= _MIN_ESS_WRITE_GAP_NS:
+                    if ctx.current_ess is not None and ctx.current_ess != desired_ess:
+                        log.warning(
+                            "Setze ESS Mode -> %s (war %s)", desired_ess, ctx.current_ess
+                        )
+                        await set_ess_mode(mb, desired_ess)
+                        ctx.last_ess_write_ns = now_ns
+                        ctx.current_ess = desired_ess  # optimistisch
+                        ctx.ess_cache_until_ns = now_ns + _MIN_ESS_WRITE_GAP_NS
+
+                # Status Log (nur aufbauen, wenn INFO überhaupt durchkommt)
+                if log.isEnabledFor(logging.INFO):
+                    log.info(
+                        _STATUS_FMT,
+                        state.name,
+                        m.soc_percent,
+                        m.load_w,
+                        m.pv_w,
+                        _YN[pv_surplus],
+                        _YN[ctx.pv_surplus_confirmed],
+                        PV_SURPLUS_CONFIRM_S,
+                        _YN[ctx.night_detected],
+                        night_below * poll_interval_s,
+                        night_confirm_s,
+                        _YN[ctx.await_next_day],
+                        _YN[ctx.night_seen_since_shutdown],
+                        mode_name(ctx.current_mode),
+                        ctx.current_ess,
+                        desired_ess,
+                    )
+
+                # ------------- State Machine (Dispatch) -------------
+                state = await _HANDLERS[state](ctx)
+                next_wake += ctx.sleep_s
+                delay = next_wake - time.monotonic()
+                if delay < 0.0:
+                    # Stall (lange Reads, Suspend): neu verankern statt aufholen
+                    next_wake = time.monotonic()
+                    delay = 0.0
+                if await _sleep_or_stop(stop, delay):
+                    break
+
+            except KeyboardInterrupt:
+                log.info("Beendet (Ctrl+C).")
+                break
+            except (ConnectionException, ModbusIOException, OSError, RuntimeError) as e:
+                # Transportfehler (inkl. Timeout): Socket verwerfen,
+                # nächste Iteration verbindet neu
+                log.error("Fehler: %s", e, exc_info=True)
+                mb.close()
+                if await _sleep_or_stop(stop, 2.0):
+                    break
+                next_wake = time.monotonic()
+            except Exception as e:
+                # Kein Transportproblem -> Verbindung nicht abreißen
+                log.error("Fehler: %s", e, exc_info=True)
+                if await _sleep_or_stop(stop, 2.0):
+                    break
+                next_wake = time.monotonic()
+    finally:
+        log.info("Beendet.")
+        mb.close()
 
 
 if __name__ == "__main__":
-    main()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        log.info("Beendet (Ctrl+C).")